@@ -18,31 +18,76 @@ import datetime
 import openpyxl
 from openpyxl import Workbook
 from openpyxl.styles import Font, PatternFill
-from imutils.video import VideoStream
 import os
 
+# Numba is optional: the finger-count kernel falls back to NumPy without it
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # ==============================================================================
 # ⚙️ SETTINGS
 # ==============================================================================
 RTSP_URL = "rtsp://192.168.0.10:8554/feeder"  # ← Change to your Pi IP
 USE_WEBCAM = False  # Set True to use laptop webcam
+FLUSH_FRAMES = 4  # RTSP frames dropped before each read (keeps latency low)
 
 # Display
 DISPLAY_WIDTH = 1000
 DISPLAY_HEIGHT = 800
 
+# Skin detection runs on the ROI shrunk by this factor (1 = full resolution)
+SKIN_DOWNSCALE = 2
+# Mask clean-up open, in full-resolution ROI pixels (divided by SKIN_DOWNSCALE for the mask)
+OPEN_KERNEL_SIZE = 13
+
+# Skin color space: "ycrcb" (one band, cheapest) or "hsv" (two hue bands OR'd)
+SKIN_COLORSPACE = "ycrcb"
+
+# Finger counting: "ring" (centroid + circle crossings) or "defects" (convexity defects)
+FINGER_METHOD = "ring"
+RING_RADIUS_RATIO = 1.8  # ring radius as a multiple of the palm radius (largest inscribed circle)
+
 # Excel logging
 EXCEL_FILE = "simple_gesture_log.xlsx"
 LOG_EVERY_N_SECONDS = 3
+SAVE_EVERY_N_ROWS = 10  # workbook stays open; written to disk every N rows and on exit
 # ==============================================================================
 
 os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "rtsp_transport;tcp|fflags;nobuffer|flags;low_delay"
 
 
+# ==============================================================================
+# 📹 CAPTURE
+# ==============================================================================
+def open_capture():
+    if USE_WEBCAM:
+        cap = cv2.VideoCapture(0)
+    else:
+        cap = cv2.VideoCapture(RTSP_URL, cv2.CAP_FFMPEG)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
+
+def read_latest(cap):
+    """Drop queued RTSP frames and return only the newest one"""
+    if not USE_WEBCAM:
+        for _ in range(FLUSH_FRAMES):
+            cap.grab()
+    ok, frame = cap.read()
+    return frame if ok else None
+
+
 # ==============================================================================
 # 📊 EXCEL LOGGING
 # ==============================================================================
+# Workbook is loaded once and kept in memory (no load+save per row)
+log_wb = None
+log_ws = None
+unsaved_rows = 0
+
 def init_excel_log():
+    global log_wb, log_ws
     if not os.path.exists(EXCEL_FILE):
         wb = Workbook()
         ws = wb.active
@@ -65,19 +110,33 @@ def init_excel_log():
         
         wb.save(EXCEL_FILE)
         print(f"✅ Excel: {EXCEL_FILE}")
+    
+    log_wb = openpyxl.load_workbook(EXCEL_FILE)
+    log_ws = log_wb.active
+
+def save_excel_log():
+    """Write pending rows to disk"""
+    global unsaved_rows
+    if log_wb is None or unsaved_rows == 0:
+        return
+    try:
+        log_wb.save(EXCEL_FILE)
+        unsaved_rows = 0
+    except Exception as e:
+        print(f"❌ Save failed: {e}")
 
 def log_to_excel(gesture, finger_count):
+    global unsaved_rows
     try:
-        wb = openpyxl.load_workbook(EXCEL_FILE)
-        ws = wb.active
-        
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         notes = f"Detected {finger_count} fingers" if finger_count > 0 else "No hand detected"
         
         row = [timestamp, gesture, finger_count, notes]
-        ws.append(row)
+        log_ws.append(row)
+        unsaved_rows += 1
         
-        wb.save(EXCEL_FILE)
+        if unsaved_rows >= SAVE_EVERY_N_ROWS:
+            save_excel_log()
         print(f"📊 Log: {gesture} ({finger_count} fingers)")
     except Exception as e:
         print(f"❌ Log failed: {e}")
@@ -86,27 +145,66 @@ def log_to_excel(gesture, finger_count):
 # ==============================================================================
 # 🤚 SIMPLE GESTURE RECOGNITION
 # ==============================================================================
+def _count_fingers_kernel(starts, ends, fars):
+    """Count defects whose angle at the far point is <= 90 degrees"""
+    count = 0
+    for i in range(starts.shape[0]):
+        v1x, v1y = starts[i, 0] - fars[i, 0], starts[i, 1] - fars[i, 1]
+        v2x, v2y = ends[i, 0] - fars[i, 0], ends[i, 1] - fars[i, 1]
+        # Degenerate triangle: angle undefined, not a finger gap
+        if (v1x == 0 and v1y == 0) or (v2x == 0 and v2y == 0):
+            continue
+        # angle <= 90 degrees  <=>  (start - far) . (end - far) >= 0
+        if v1x * v2x + v1y * v2y >= 0:
+            count += 1
+    return count
+
+if njit is not None:
+    _count_fingers_kernel = njit(cache=True)(_count_fingers_kernel)
+
+
 class SimpleGestureDetector:
     def __init__(self):
-        # Skin color range in HSV (adjust for your skin tone)
-        self.lower_skin = np.array([0, 20, 70], dtype=np.uint8)
-        self.upper_skin = np.array([20, 255, 255], dtype=np.uint8)
+        # Skin color bands (adjust for your skin tone); the mask is the OR of all bands
+        if SKIN_COLORSPACE == "hsv":
+            self.conversion = cv2.COLOR_BGR2HSV
+            self.skin_bands = [
+                (np.array([0, 30, 60], dtype=np.uint8), np.array([17, 170, 255], dtype=np.uint8)),
+                (np.array([170, 30, 60], dtype=np.uint8), np.array([180, 170, 255], dtype=np.uint8)),  # red hue wrap-around
+            ]
+        else:
+            self.conversion = cv2.COLOR_BGR2YCrCb
+            self.skin_bands = [
+                (np.array([0, 135, 85], dtype=np.uint8), np.array([255, 180, 135], dtype=np.uint8)),
+            ]
+        # Morphology kernel (built once, reused every frame); the mask is SKIN_DOWNSCALE
+        # times smaller than the ROI, so the kernel shrinks with it (kept odd)
+        ksize = max(OPEN_KERNEL_SIZE // SKIN_DOWNSCALE, 1) | 1
+        self.kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (ksize, ksize))
+        # Run the mask pipeline on the GPU (OpenCL T-API) when available
+        self.use_opencl = cv2.ocl.haveOpenCL()
+        cv2.ocl.setUseOpenCL(self.use_opencl)
     
     def detect_skin(self, frame):
         """Detect skin-colored regions"""
-        # Convert to HSV
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        if self.use_opencl:
+            frame = cv2.UMat(frame)
+        
+        # Convert to skin color space (YCrCb is a linear transform, cheaper than HSV)
+        converted = cv2.cvtColor(frame, self.conversion)
         
         # Threshold for skin
-        mask = cv2.inRange(hsv, self.lower_skin, self.upper_skin)
+        lower, upper = self.skin_bands[0]
+        mask = cv2.inRange(converted, lower, upper)
+        for lower, upper in self.skin_bands[1:]:
+            mask = cv2.bitwise_or(mask, cv2.inRange(converted, lower, upper))
         
-        # Clean up noise
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (11, 11))
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+        # Clean up noise (single open pass; small holes are tolerated by findContours + area filter)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
         
-        # Blur
-        mask = cv2.GaussianBlur(mask, (3, 3), 0)
+        # Back to a NumPy array for findContours
+        if self.use_opencl:
+            mask = mask.get()
         
         return mask
     
@@ -115,29 +213,47 @@ class SimpleGestureDetector:
         if defects is None:
             return 0
         
-        finger_count = 0
-        
-        for i in range(defects.shape[0]):
-            s, e, f, d = defects[i, 0]
-            start = tuple(contour[s][0])
-            end = tuple(contour[e][0])
-            far = tuple(contour[f][0])
-            
-            # Calculate lengths of triangle sides
-            a = np.sqrt((end[0] - start[0])**2 + (end[1] - start[1])**2)
-            b = np.sqrt((far[0] - start[0])**2 + (far[1] - start[1])**2)
-            c = np.sqrt((end[0] - far[0])**2 + (end[1] - far[1])**2)
-            
-            # Calculate angle
-            angle = np.arccos((b**2 + c**2 - a**2) / (2 * b * c))
-            
-            # If angle < 90 degrees, count as a finger gap
-            if angle <= np.pi / 2:
-                finger_count += 1
-        
+        # Triangle corners for all defects at once, shape (N, 2)
+        starts = contour[defects[:, 0, 0], 0, :].astype(np.int64)
+        ends = contour[defects[:, 0, 1], 0, :].astype(np.int64)
+        fars = contour[defects[:, 0, 2], 0, :].astype(np.int64)
+
+        if njit is not None:
+            # JIT-compiled loop: no temporaries for small N
+            finger_count = _count_fingers_kernel(starts, ends, fars)
+        else:
+            # Triangle edges leaving the far point
+            v1 = starts - fars
+            v2 = ends - fars
+
+            # If angle <= 90 degrees (dot >= 0), count as a finger gap;
+            # zero-length edges give an undefined angle and are skipped
+            dot = (v1 * v2).sum(1)
+            valid = v1.any(1) & v2.any(1)
+            finger_count = int(np.count_nonzero((dot >= 0) & valid))
+
         # Add 1 because finger count = defects + 1
         return finger_count + 1 if finger_count > 0 else 0
     
+    def count_fingers_ring(self, mask, contour):
+        """Count extended fingers by sampling the hand mask on a ring around the palm centre"""
+        hand = np.zeros_like(mask)
+        cv2.drawContours(hand, [contour], -1, 255, cv2.FILLED)
+        
+        # Palm = largest inscribed circle (a forearm in view doesn't pull it off-centre)
+        dist = cv2.distanceTransform(hand, cv2.DIST_L2, 3)
+        _, palm_r, _, (cx, cy) = cv2.minMaxLoc(dist)
+        if palm_r < 1:
+            return 0
+        
+        ring = np.zeros_like(mask)
+        cv2.circle(ring, (cx, cy), int(RING_RADIUS_RATIO * palm_r), 255, 2)
+        ring = cv2.bitwise_and(ring, hand)
+        
+        # Each finger (and the wrist) crosses the ring once
+        arcs, _ = cv2.findContours(ring, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return max(len(arcs) - 1, 0)
+    
     def recognize_gesture(self, finger_count):
         """Convert finger count to gesture name"""
         if finger_count == 0:
@@ -192,12 +308,13 @@ def main():
     
     if USE_WEBCAM:
         print("📹 Using webcam")
-        cap = VideoStream(0).start()
     else:
         print(f"📹 Pi Camera: {RTSP_URL}")
-        cap = VideoStream(RTSP_URL).start()
+    cap = open_capture()
     
-    time.sleep(2.0)
+    if not cap.isOpened():
+        print("❌ Cannot open video source")
+        return
     print("✅ Connected!\n")
     print("Gestures: 👊 FIST | ✌️ PEACE | ✋ OPEN HAND")
     print(f"📊 Logging: {EXCEL_FILE} (every {LOG_EVERY_N_SECONDS}s)")
@@ -208,6 +325,15 @@ def main():
     print("\nPress 'q' to quit\n")
     
     detector = SimpleGestureDetector()
+    if njit is not None:
+        # Compile the finger-count kernel now, not on the first hand in view
+        z = np.zeros((1, 2), dtype=np.int64)
+        _count_fingers_kernel(z, z, z)
+    
+    # Let the window scale the frame (no per-frame cv2.resize)
+    window_name = '🤚 Simple Gesture Detection'
+    cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+    cv2.resizeWindow(window_name, DISPLAY_WIDTH, DISPLAY_HEIGHT)
     
     frame_count = 0
     fps_start = time.time()
@@ -221,8 +347,12 @@ def main():
     
     try:
         while True:
-            frame = cap.read()
+            frame = read_latest(cap)
             if frame is None:
+                # Stream dropped: back off, but keep the window responsive so 'q' still quits
+                time.sleep(0.01)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
                 continue
             
             # Mirror for easier interaction
@@ -232,8 +362,14 @@ def main():
             h, w = frame.shape[:2]
             roi = frame[0:h, int(w/2):w]  # Right half
             
-            # Detect skin
-            skin_mask = detector.detect_skin(roi)
+            # Detect skin on a downscaled copy of the ROI
+            small_roi = cv2.resize(roi, (roi.shape[1] // SKIN_DOWNSCALE, roi.shape[0] // SKIN_DOWNSCALE),
+                                   interpolation=cv2.INTER_AREA)
+            skin_mask = detector.detect_skin(small_roi)
+            
+            # Only the mask is needed from here on; overlays go on the full frame
+            del roi, small_roi
+            roi_offset = (int(w/2), 0)
             
             # Find contours
             contours, _ = cv2.findContours(skin_mask, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
@@ -242,24 +378,41 @@ def main():
             
             if contours:
                 # Get largest contour (assume it's the hand)
-                max_contour = max(contours, key=cv2.contourArea)
+                areas = np.fromiter((cv2.contourArea(c) for c in contours),
+                                    dtype=np.float32, count=len(contours))
+                idx = int(areas.argmax())
+                hand_contour = contours[idx]
+                
+                # Scale back to ROI coordinates
+                max_contour = hand_contour * SKIN_DOWNSCALE
                 
-                # Only process if contour is large enough
-                if cv2.contourArea(max_contour) > 5000:
-                    # Draw contour on ROI
-                    cv2.drawContours(roi, [max_contour], -1, (0, 255, 0), 2)
+                # Only process if contour is large enough (area in ROI pixels)
+                if areas[idx] * SKIN_DOWNSCALE**2 > 5000:
+                    if FINGER_METHOD == "ring":
+                        # Ring test runs in mask coordinates
+                        finger_count = detector.count_fingers_ring(skin_mask, hand_contour)
+                    
+                        # Draw contour on frame (shifted into the ROI)
+                        cv2.drawContours(frame, [max_contour], -1, (0, 255, 0), 2, offset=roi_offset)
+                    else:
+                        # Simplify contour so hull/defects work on fewer points
+                        epsilon = 0.005 * cv2.arcLength(max_contour, True)
+                        max_contour = cv2.approxPolyDP(max_contour, epsilon, True)
+                    
+                        # Draw contour on frame (shifted into the ROI)
+                        cv2.drawContours(frame, [max_contour], -1, (0, 255, 0), 2, offset=roi_offset)
                     
-                    # Get convex hull
-                    hull = cv2.convexHull(max_contour, returnPoints=False)
+                        # Get convex hull
+                        hull = cv2.convexHull(max_contour, returnPoints=False)
                     
-                    # Get convexity defects
-                    if len(hull) > 3 and len(max_contour) > 3:
-                        defects = cv2.convexityDefects(max_contour, hull)
-                        finger_count = detector.count_fingers(max_contour, defects)
+                        # Get convexity defects
+                        if len(hull) > 3 and len(max_contour) > 3:
+                            defects = cv2.convexityDefects(max_contour, hull)
+                            finger_count = detector.count_fingers(max_contour, defects)
                         
-                        # Draw hull
-                        hull_points = cv2.convexHull(max_contour)
-                        cv2.drawContours(roi, [hull_points], -1, (255, 0, 0), 2)
+                            # Draw hull (reuse the hull indices computed above)
+                            hull_points = max_contour[hull[:, 0]]
+                            cv2.drawContours(frame, [hull_points], -1, (255, 0, 0), 2, offset=roi_offset)
             
             # Recognize gesture
             current_gesture = detector.recognize_gesture(finger_count)
@@ -287,8 +440,7 @@ def main():
             draw_info(frame, current_gesture, current_fingers, fps)
             
             # Display
-            display_frame = cv2.resize(frame, (DISPLAY_WIDTH, DISPLAY_HEIGHT))
-            cv2.imshow('🤚 Simple Gesture Detection', display_frame)
+            cv2.imshow(window_name, frame)
             
             # Quit
             if cv2.waitKey(1) & 0xFF == ord('q'):
@@ -302,7 +454,8 @@ def main():
     
     finally:
         print("🧹 Cleanup...")
-        cap.stop()
+        save_excel_log()
+        cap.release()
         cv2.destroyAllWindows()
         print(f"✅ Done! Check {EXCEL_FILE}\n")
 
@@ -13,6 +13,15 @@ class Options:
     def endpoint(self, route) -> str:
         return self.serverUrl + route
 
+    def warmUpDetector(self, session, jpg_bytes: bytes, timeout: float = 5.0) -> None:
+        # send one throwaway image to the face detector so the server's cold start
+        # (model load, thread pools) is paid before the caller's live loop;
+        # errors are ignored, the live loop reports an unreachable server itself
+        try:
+            session.post(self.endpoint("vision/face"), files={"image": jpg_bytes}, timeout=timeout)
+        except Exception:
+            pass
+
     def cleanDetectedDir(self) -> None:
         # make sure the detected directory exists
         if not os.path.exists(self.detectedDir):
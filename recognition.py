@@ -4,10 +4,10 @@
 
 import os
 import cv2
+import numpy as np
 import requests
 import datetime
 from options import Options
-from imutils.video import VideoStream
 
 opts = Options()
 rtsp_url = "rtsp://169.254.15.175:8554/feeder"
@@ -15,15 +15,21 @@ rtsp_url = "rtsp://169.254.15.175:8554/feeder"
 if not getattr(opts, "imageDir", "") or opts.imageDir.strip() == "":
     opts.imageDir = "images"
 os.makedirs(opts.imageDir, exist_ok=True)
+DETECT_URL = opts.endpoint("vision/face")
+RECOGNIZE_URL = opts.endpoint("vision/face/recognize")
 
-SKIP_FRAME = 5
+# One pooled connection for detect + recognize (no TCP handshake per call)
+session = requests.Session()
+
+SKIP_FRAME = 5                # process 1 of every N frames (others are grabbed, not decoded)
 MIN_RECOG_CONFIDENCE = 0.70   # raise to 0.80 if mislabels happen
+JPEG_QUALITY = 70             # lower = faster encode + smaller upload
 
 def recognize_face_bytes(image_bytes: bytes) -> dict:
     """Send bytes (cropped face) to server for recognition."""
     try:
-        return requests.post(
-            opts.endpoint("vision/face/recognize"),
+        return session.post(
+            RECOGNIZE_URL,
             files={"image": image_bytes},
             data={"min_confidence": MIN_RECOG_CONFIDENCE}
         ).json()
@@ -33,105 +39,124 @@ def recognize_face_bytes(image_bytes: bytes) -> dict:
 def clamp(v, lo, hi):
     return max(lo, min(hi, v))
 
-def main():
-    cap = VideoStream(rtsp_url).start()
-    frame_index = 0
+def draw_timestamp(frame):
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cv2.putText(frame, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
+                1, (0, 255, 0), 1, cv2.LINE_AA)
 
-    while True:
-        # quit
-        if cv2.waitKey(1) & 0xFF == ord("q"):
-            print("Stop capturing...")
-            break
+def read_latest(cap):
+    """Drop the skipped frames with grab() and retrieve only the one we process."""
+    for _ in range(SKIP_FRAME - 1):
+        cap.grab()
+    ok, frame = cap.read()
+    return frame if ok else None
 
-        frame = cap.read()
-        if frame is None:
-            print("Camera closed")
-            break
+def annotate_frame(frame):
+    """Detect + recognize faces on a clean frame, then draw the results onto it."""
+    h, w = frame.shape[:2]
 
-        frame_index += 1
-        if SKIP_FRAME > 1 and (frame_index % SKIP_FRAME != 0):
-            continue
+    # Nothing is drawn on the frame until all encoding/cropping is done,
+    # so it doubles as the clean recognition input (no full-frame copy)
 
-        raw_frame = frame.copy()
-        h, w = raw_frame.shape[:2]
+    # Detect faces (get bounding boxes)
+    ok, jpg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        draw_timestamp(frame)
+        return
 
-        # Timestamp (display)
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cv2.putText(frame, timestamp, (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
-                    1, (0, 255, 0), 1, cv2.LINE_AA)
+    try:
+        detect_resp = session.post(
+            DETECT_URL,
+            files={"image": jpg}
+        ).json()
+    except requests.exceptions.RequestException as e:
+        raise SystemExit(e)
 
-        # Detect faces (get bounding boxes)
-        ok, jpg = cv2.imencode(".jpg", raw_frame)
-        if not ok:
-            cv2.imshow("Image Viewer", frame)
+    detections = detect_resp.get("predictions", [])
+
+    if len(detections) == 0:
+        draw_timestamp(frame)
+        cv2.putText(frame, "No face detected", (10, 65),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2, cv2.LINE_AA)
+        return
+
+    # For each detected face -> crop -> recognize -> label
+    faces = []
+    for d in detections:
+        x1 = clamp(int(d["x_min"]), 0, w - 1)
+        y1 = clamp(int(d["y_min"]), 0, h - 1)
+        x2 = clamp(int(d["x_max"]), 0, w - 1)
+        y2 = clamp(int(d["y_max"]), 0, h - 1)
+
+        # Add padding (helps recognition)
+        pad = 20
+        x1p = clamp(x1 - pad, 0, w - 1)
+        y1p = clamp(y1 - pad, 0, h - 1)
+        x2p = clamp(x2 + pad, 0, w - 1)
+        y2p = clamp(y2 + pad, 0, h - 1)
+
+        face_crop = frame[y1p:y2p, x1p:x2p]
+
+        # If crop too small, skip
+        if face_crop.size == 0 or (x2p - x1p) < 40 or (y2p - y1p) < 40:
             continue
 
-        try:
-            detect_resp = requests.post(
-                opts.endpoint("vision/face"),
-                files={"image": jpg}
-            ).json()
-        except requests.exceptions.RequestException as e:
-            raise SystemExit(e)
-
-        detections = detect_resp.get("predictions", [])
-
-        if len(detections) == 0:
-            cv2.putText(frame, "No face detected", (10, 65),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2, cv2.LINE_AA)
-            cv2.imshow("Image Viewer", frame)
+        # Encode crop to jpg bytes
+        ok2, face_jpg = cv2.imencode(".jpg", face_crop, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if not ok2:
             continue
 
-        # For each detected face -> crop -> recognize -> label
-        for d in detections:
-            x1 = clamp(int(d["x_min"]), 0, w - 1)
-            y1 = clamp(int(d["y_min"]), 0, h - 1)
-            x2 = clamp(int(d["x_max"]), 0, w - 1)
-            y2 = clamp(int(d["y_max"]), 0, h - 1)
-
-            # Add padding (helps recognition)
-            pad = 20
-            x1p = clamp(x1 - pad, 0, w - 1)
-            y1p = clamp(y1 - pad, 0, h - 1)
-            x2p = clamp(x2 + pad, 0, w - 1)
-            y2p = clamp(y2 + pad, 0, h - 1)
-
-            face_crop = raw_frame[y1p:y2p, x1p:x2p]
+        # Recognize this face
+        result = recognize_face_bytes(face_jpg.tobytes())
+        preds = result.get("predictions", [])
 
-            # If crop too small, skip
-            if face_crop.size == 0 or (x2p - x1p) < 40 or (y2p - y1p) < 40:
-                continue
+        # Default label
+        label = "Unknown"
+        conf = 0.0
 
-            # Encode crop to jpg bytes
-            ok2, face_jpg = cv2.imencode(".jpg", face_crop)
-            if not ok2:
-                continue
+        if len(preds) > 0:
+            top = preds[0]
+            userid = top.get("userid", "unknown")
+            conf = float(top.get("confidence", top.get("score", 0.0)) or 0.0)
 
-            # Recognize this face
-            result = recognize_face_bytes(face_jpg.tobytes())
-            preds = result.get("predictions", [])
+            if userid and str(userid).lower() != "unknown" and conf >= MIN_RECOG_CONFIDENCE:
+                label = f"{userid} ({conf:.2f})"
 
-            # Default label
-            label = "Unknown"
-            conf = 0.0
+        faces.append((x1, y1, x2, y2, label))
 
-            if len(preds) > 0:
-                top = preds[0]
-                userid = top.get("userid", "unknown")
-                conf = float(top.get("confidence", top.get("score", 0.0)) or 0.0)
+    # Draw rectangle + label for each face
+    draw_timestamp(frame)
+    for x1, y1, x2, y2, label in faces:
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
+        cv2.putText(frame, label, (x1, max(20, y1 - 10)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2, cv2.LINE_AA)
 
-                if userid and str(userid).lower() != "unknown" and conf >= MIN_RECOG_CONFIDENCE:
-                    label = f"{userid} ({conf:.2f})"
-
-            # Draw rectangle + label for THIS face only
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
-            cv2.putText(frame, label, (x1, max(20, y1 - 10)),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2, cv2.LINE_AA)
+def main():
+    cap = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    if not cap.isOpened():
+        print("Cannot open stream")
+        return
+
+    _, warm_jpg = cv2.imencode(".jpg", np.zeros((64, 64, 3), np.uint8))
+    opts.warmUpDetector(session, warm_jpg.tobytes())
+    while True:
+        frame = read_latest(cap)
+        if frame is None:
+            print("Camera closed")
+            break
 
+        annotate_frame(frame)
         cv2.imshow("Image Viewer", frame)
 
-    cap.stop()
+        # quit (one waitKey per displayed frame)
+        if cv2.waitKey(1) & 0xFF == ord("q"):
+            print("Stop capturing...")
+            break
+
+    cap.release()
     cv2.destroyAllWindows()
+    session.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,62 +1,283 @@
 #!/usr/bin/env python3
 import cv2
+import numpy as np
 import socket
 import time
 import threading
+import queue
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import datetime
 import os
+import csv
 import openpyxl
 from openpyxl.styles import PatternFill, Font, Alignment
-from imutils.video import VideoStream
 from options import Options
 
+# JPEG encoders are optional, fastest first: nvJPEG (NVIDIA GPU, pynvjpeg),
+# simplejpeg (libjpeg-turbo), then cv2.imencode
+try:
+    from nvjpeg import NvJpeg
+except ImportError:
+    NvJpeg = None
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+# orjson decodes the API responses faster than stdlib json (optional)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Configuration
 PI_IP = "100.109.95.64"
 RTSP_URL = "rtsp://100.109.95.64:8554/feeder"
 UDP_PORT = 5005
+LED_OFF_DELAY = 0.2  # seconds the LED stays ON before it may switch OFF (debounces flicker)
 MIN_CONFIDENCE = 0.6
 RESIZE_WIDTH = 640
-LOG_FILE = "recognition_log.xlsx"  # 🆕 Excel log file
+JPEG_QUALITY = 70
+DETECT_EVERY = 10  # frames between detection API calls (trackers fill the gaps)
+# Local face pre-filter: faces below these go straight to "Unknown" without a recognize call
+MIN_FACE_AREA = 60 * 60  # in full-resolution stream pixels
+BLUR_THRESHOLD = 30.0   # Laplacian variance below this = too blurry
+LABEL_REUSE_SECONDS = 2.0  # reuse a known label for an overlapping bbox this long
+LABEL_REUSE_IOU = 0.5
+CSV_LOG_FILE = "recognition_log.csv"  # appended live
+LOG_FILE = "recognition_log.xlsx"  # 🆕 Excel report, rebuilt from the CSV on exit
+LOG_FLUSH_ROWS = 20      # logger thread flushes the CSV every N rows...
+LOG_FLUSH_SECONDS = 5.0  # ...and at most this long after a row was written
+FLUSH_FRAMES = 4  # RTSP frames dropped before each read (keeps latency low)
+# Hardware H.264 decode via GStreamer (None = FFmpeg software decode). Examples:
+#   Jetson: "nvv4l2decoder ! nvvidconv ! video/x-raw,format=BGRx"
+#   Raspberry Pi: "v4l2h264dec"   Intel/AMD: "vaapih264dec"   CPU: "avdec_h264"
+GST_DECODER = None
+
+class FrameHandoff:
+    """ Latest-frame handoff from the capture loop to the worker.
+
+    A ring of preallocated buffers changes owner: capture resizes the frame
+    straight into the buffer it owns (one pass, no allocation) and publishes
+    it through a size-1 queue, the worker blocks on the queue for the newest
+    one and hands it back when done. Three buffers let capture never wait:
+    one being written, one published, one being read. An unread frame is
+    reclaimed by the next publish (latest wins).
+    """
+    RING_SIZE = 3
+
+    def __init__(self):
+        self.ready = queue.Queue(maxsize=1)  # newest published frame
+        self.free = []    # buffers the worker has finished with
+        self.write_buf = None
+        self.shape = None
+        self.scale = 1.0  # published width / stream width
+
+    def publish(self, frame, width):
+        h, w = frame.shape[:2]
+        shape = (int(h * width / w), width, frame.shape[2])
+        if shape != self.shape:
+            # Build the ring on the first frame (or after a resolution change)
+            self.shape = shape
+            self.scale = width / w
+            self.drain()
+            ring = [np.empty(shape, dtype=frame.dtype) for _ in range(self.RING_SIZE)]
+            self.write_buf = ring.pop()
+            self.free = ring
+        buf = self.write_buf
+        cv2.resize(frame, (width, shape[0]), dst=buf)
+        # Reuse the previous frame if the worker never picked it up; capture is
+        # the only producer, so the queue is empty again for the put below
+        try:
+            self.write_buf = self.ready.get_nowait()
+        except queue.Empty:
+            self.write_buf = self.free.pop() if self.free else np.empty(shape, dtype=frame.dtype)
+        self.ready.put_nowait(buf)
+
+    def drain(self):
+        try:
+            while True:
+                self.ready.get_nowait()
+        except queue.Empty:
+            pass
+
+    def take(self, timeout):
+        """ Wait for the newest unread frame (owned by the caller until release), None on timeout """
+        try:
+            return self.ready.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, buf):
+        # Buffers from before a resolution change are simply dropped
+        if buf.shape == self.shape:
+            self.free.append(buf)
 
 # Global state for threading
-latest_frame = None
+frames = FrameHandoff()
 cached_results = []
 is_running = True
-new_frame_available = False
+recent_labels = []  # (bbox, name, confidence, time) of recent known faces, worker-only
 
 # Socket & Session setup
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+sock.setblocking(False)  # a full send buffer must never stall the worker
 session = requests.Session()
+# Keep-Alive pool big enough for detect + concurrent recognize bursts;
+# one quick retry re-opens a connection the server dropped. Every call here is a
+# POST, which urllib3 never retries by default; detect/recognize have no side
+# effects, so they are safe to resend
+adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32,
+                      max_retries=Retry(total=1, backoff_factor=0, status_forcelist=[502, 503],
+                                        allowed_methods=frozenset({"POST"})))
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+session.headers["Connection"] = "keep-alive"
+session.headers["Accept-Encoding"] = "identity"  # responses are tiny; skip gzip decode
 opts = Options()
+DETECT_URL = opts.endpoint("vision/face")
+RECOGNIZE_URL = opts.endpoint("vision/face/recognize")
+recognize_pool = ThreadPoolExecutor(max_workers=8)  # Concurrent per-face recognize calls
 current_led_state = None
+last_led_change = 0.0
 
-# 🆕 Logging lock to prevent concurrent writes
-log_lock = threading.Lock()
+# CSV log: the worker only enqueues events, one logger thread owns the file
+log_queue = queue.Queue()
+log_thread = None
+log_file = None
+log_writer = None
+log_rows = 0
+LOG_HEADERS = ["#", "Timestamp", "Name", "Confidence", "Status", "LED"]
 
 # ─────────────────────────────────────────
-# 🆕 EXCEL LOGGING FUNCTIONS
+# 🆕 LOGGING FUNCTIONS
 # ─────────────────────────────────────────
-def init_excel_log():
-    """Create Excel file with headers if it doesn't exist."""
+def init_log():
+    """Open the CSV log for appending (header written once) and start its writer thread."""
+    global log_file, log_writer, log_rows, log_thread
+    is_new = not os.path.exists(CSV_LOG_FILE)
+    if not is_new:
+        with open(CSV_LOG_FILE, newline="") as f:
+            log_rows = max(sum(1 for _ in f) - 1, 0)
+    
+    log_file = open(CSV_LOG_FILE, "a", newline="")
+    log_writer = csv.writer(log_file)
+    if is_new:
+        log_writer.writerow(LOG_HEADERS)
+        log_rows = import_excel_rows()
+        log_file.flush()
+        print(f"📊 CSV log created: {CSV_LOG_FILE}")
+    
+    log_thread = threading.Thread(target=logger_thread, daemon=True)
+    log_thread.start()
+
+def import_excel_rows():
+    """Carry the rows of an existing Excel log (written before the CSV log existed)
+    into the new CSV, so the export on exit doesn't drop them. Returns the row count."""
     if not os.path.exists(LOG_FILE):
+        return 0
+    rows = 0
+    try:
+        wb = openpyxl.load_workbook(LOG_FILE, read_only=True)
+        for values in wb.active.iter_rows(min_row=2, values_only=True):
+            if any(v is not None for v in values):
+                log_writer.writerow(["" if v is None else v for v in values[:len(LOG_HEADERS)]])
+                rows += 1
+        wb.close()
+        print(f"📊 Imported {rows} rows from {LOG_FILE}")
+    except Exception as e:
+        print(f"❌ Excel import Error: {e}")
+    return rows
+
+def log_event(name, confidence, led_state):
+    """Queue a recognition event for the logger thread (never blocks the worker)."""
+    log_queue.put_nowait((datetime.datetime.now(), name, confidence, led_state))
+
+def logger_thread():
+    """Sole writer of the CSV log; flushes every LOG_FLUSH_ROWS rows and at least
+    every LOG_FLUSH_SECONDS while rows are pending. A None event flushes and stops it."""
+    global log_rows
+    unflushed = 0
+    last_flush = time.monotonic()
+    while True:
+        # Nothing pending -> sleep until the next event; else wake at the flush deadline
+        timeout = None
+        if unflushed:
+            timeout = max(LOG_FLUSH_SECONDS - (time.monotonic() - last_flush), 0)
+        try:
+            event = log_queue.get(timeout=timeout)
+        except queue.Empty:
+            event = False  # flush deadline reached
+        
+        if event:
+            try:
+                when, name, confidence, led_state = event
+                log_rows += 1
+                status = "Recognized" if name != "Unknown" else "Unknown"
+                led = "ON" if led_state else "OFF"
+                log_writer.writerow([log_rows, when.strftime("%Y-%m-%d %H:%M:%S"), name,
+                                     f"{confidence:.3f}", status, led])
+                unflushed += 1
+            except Exception as e:
+                print(f"❌ Log Error: {e}")
+        
+        now = time.monotonic()
+        if unflushed and (not event or unflushed >= LOG_FLUSH_ROWS
+                          or now - last_flush >= LOG_FLUSH_SECONDS):
+            log_file.flush()
+            unflushed = 0
+            last_flush = now
+        if event is None:
+            return
+
+def close_log():
+    """Stop the logger thread after it has written every queued event."""
+    log_queue.put(None)
+    log_thread.join()
+    log_file.close()
+
+def export_excel_log():
+    """Convert the CSV log into the styled Excel report (once, at shutdown)."""
+    try:
         wb = openpyxl.Workbook()
         ws = wb.active
         ws.title = "Recognition Log"
         
-        # Headers
-        headers = ["#", "Timestamp", "Name", "Confidence", "Status", "LED"]
-        ws.append(headers)
-        
         # Style headers
         header_fill = PatternFill(start_color="2D2D2D", end_color="2D2D2D", fill_type="solid")
         header_font = Font(bold=True, color="FFFFFF")
         
-        for col, _ in enumerate(headers, start=1):
-            cell = ws.cell(row=1, column=col)
-            cell.fill = header_fill
-            cell.font = header_font
-            cell.alignment = Alignment(horizontal="center")
+        # Color rows based on status
+        known_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")  # Green
+        known_font = Font(color="276221")
+        unknown_fill = PatternFill(start_color="FFCCCC", end_color="FFCCCC", fill_type="solid")  # Red
+        unknown_font = Font(color="9C0006")
+        center = Alignment(horizontal="center")
+        
+        with open(CSV_LOG_FILE, newline="") as f:
+            for i, values in enumerate(csv.reader(f)):
+                if i > 0:
+                    # CSV cells are text; store "#" and confidence as numbers again
+                    try:
+                        values[0] = int(values[0])
+                        values[3] = float(values[3])
+                    except (ValueError, IndexError):
+                        pass
+                ws.append(values)
+                if i == 0:
+                    fill, font = header_fill, header_font
+                elif values[4] != "Unknown":
+                    fill, font = known_fill, known_font
+                else:
+                    fill, font = unknown_fill, unknown_font
+                for cell in ws[ws.max_row]:
+                    cell.fill = fill
+                    cell.font = font
+                    cell.alignment = center
+                if i > 0:
+                    ws.cell(row=ws.max_row, column=4).number_format = "0.000"
         
         # Column widths
         ws.column_dimensions['A'].width = 5
@@ -67,124 +288,243 @@ def init_excel_log():
         ws.column_dimensions['F'].width = 10
         
         wb.save(LOG_FILE)
-        print(f"📊 Excel log created: {LOG_FILE}")
-
-def log_to_excel(name, confidence, led_state):
-    """Append a recognition event to Excel log."""
-    with log_lock:
-        try:
-            wb = openpyxl.load_workbook(LOG_FILE)
-            ws = wb.active
-            
-            # Row data
-            row_num = ws.max_row  # Current row count (excluding header)
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            status = "Recognized" if name != "Unknown" else "Unknown"
-            led = "ON" if led_state else "OFF"
-            
-            ws.append([row_num, timestamp, name, f"{confidence:.3f}", status, led])
-            
-            # Color rows based on status
-            row = ws.max_row
-            if name != "Unknown":
-                fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")  # Green
-                font = Font(color="276221")
-            else:
-                fill = PatternFill(start_color="FFCCCC", end_color="FFCCCC", fill_type="solid")  # Red
-                font = Font(color="9C0006")
-            
-            for col in range(1, 7):
-                cell = ws.cell(row=row, column=col)
-                cell.fill = fill
-                cell.font = font
-                cell.alignment = Alignment(horizontal="center")
-            
-            wb.save(LOG_FILE)
-            
-        except Exception as e:
-            print(f"❌ Log Error: {e}")
+    except Exception as e:
+        print(f"❌ Excel export Error: {e}")
 
 # ─────────────────────────────────────────
 # EXISTING FUNCTIONS (unchanged)
 # ─────────────────────────────────────────
-def control_led(should_be_on):
-    global current_led_state
+def control_led(should_be_on, force=False):
+    global current_led_state, last_led_change
     if current_led_state != should_be_on:
+        now = time.monotonic()
+        # ON switches immediately; OFF waits out the dead-band
+        if not should_be_on and not force and now - last_led_change <= LED_OFF_DELAY:
+            return
         try:
             sock.sendto(b'LED_ON' if should_be_on else b'LED_OFF', (PI_IP, UDP_PORT))
             current_led_state = should_be_on
+            last_led_change = now
         except Exception as e:
             print(f"LED Error: {e}")
 
+# Per-thread staging buffer for non-contiguous crops (reused, grown on demand)
+encode_local = threading.local()
+
+def as_contiguous(img):
+    """ C-contiguous view of img, copied into this thread's reusable buffer if needed """
+    if img.flags.c_contiguous:
+        return img
+    buf = getattr(encode_local, "buf", None)
+    if buf is None or buf.dtype != img.dtype or buf.size < img.size:
+        buf = encode_local.buf = np.empty(img.size, dtype=img.dtype)
+    out = buf[:img.size].reshape(img.shape)
+    np.copyto(out, img)
+    return out
+
+def gpu_encoder():
+    """ This thread's nvJPEG handle (None if no GPU encoder is usable) """
+    if NvJpeg is None:
+        return None
+    if not hasattr(encode_local, "nvjpeg"):
+        try:
+            encode_local.nvjpeg = NvJpeg()
+        except Exception as e:
+            print(f"nvJPEG unavailable, using CPU encoder: {e}")
+            encode_local.nvjpeg = None
+    return encode_local.nvjpeg
+
+def encode_jpg(img):
+    """ JPEG-encode a BGR image to bytes """
+    nj = gpu_encoder()
+    if nj is not None:
+        return nj.encode(as_contiguous(img), JPEG_QUALITY)
+    if simplejpeg is not None:
+        return simplejpeg.encode_jpeg(as_contiguous(img), quality=JPEG_QUALITY,
+                                      colorspace='BGR', fastdct=True)
+    _, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    return encoded.tobytes()
+
+def parse_json(resp):
+    """ Decode a response body, straight from bytes when orjson is available """
+    return orjson.loads(resp.content) if orjson is not None else resp.json()
+
+def recognize_face(face_bytes):
+    """ Recognize one encoded face crop, returns (name, confidence) """
+    rec_res = parse_json(session.post(
+        RECOGNIZE_URL,
+        files={"image": face_bytes},
+        data={"min_confidence": MIN_CONFIDENCE},
+        timeout=1
+    ))
+    
+    name = "Unknown"
+    conf = 0
+    if rec_res.get("predictions"):
+        user = rec_res["predictions"][0]
+        name = user.get("userid", "Unknown")
+        conf = user.get("confidence", 0)
+    return name, conf
+
+def recognize_crop(face):
+    """ Encode + recognize one face crop (runs on recognize_pool; the
+    JPEG encoder releases the GIL, so crops encode in parallel) """
+    return recognize_face(encode_jpg(face))
+
+def is_blurry(face):
+    gray = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+    return cv2.Laplacian(gray, cv2.CV_64F).var() < BLUR_THRESHOLD
+
+def iou(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+def reuse_label(bbox, now):
+    """ (name, conf) of a known face recognized at this spot moments ago, or None """
+    for prev_bbox, name, conf, t in recent_labels:
+        if now - t <= LABEL_REUSE_SECONDS and iou(bbox, prev_bbox) >= LABEL_REUSE_IOU:
+            return name, conf
+    return None
+
+def detect_and_recognize(small_frame):
+    """ Detect faces on the downscaled frame, then recognize each crop.
+    Bboxes are in small-frame coordinates. """
+    # 1-2. Encode + API Detection
+    detect_response = parse_json(session.post(
+        DETECT_URL,
+        files={"image": encode_jpg(small_frame)},
+        timeout=1
+    ))
+    
+    global recent_labels
+    predictions = detect_response.get('predictions', [])
+    results = []
+    pending = []
+    now = time.time()
+    # MIN_FACE_AREA is in stream pixels; bboxes here are in the downscaled frame
+    min_area = MIN_FACE_AREA * frames.scale ** 2
+    
+    if predictions:
+        # Crops are views into the handoff buffer: every submitted task must finish
+        # before the buffer can be released, even if building the batch raises
+        try:
+            for pred in predictions:
+                x_min, y_min = int(pred['x_min']), int(pred['y_min'])
+                x_max, y_max = int(pred['x_max']), int(pred['y_max'])
+                bbox = (x_min, y_min, x_max, y_max)
+                
+                face = small_frame[y_min:y_max, x_min:x_max]
+                if face.size == 0: continue
+                
+                # Tiny or blurry crops would come back "Unknown" anyway: label them
+                # without the API call (still boxed, logged and counted for the LED)
+                if (x_max - x_min) * (y_max - y_min) < min_area or is_blurry(face):
+                    pending.append((bbox, ("Unknown", 0)))
+                    continue
+                
+                # Same spot as a face recognized moments ago -> reuse its label
+                label = reuse_label(bbox, now)
+                if label is not None:
+                    pending.append((bbox, label))
+                    continue
+                
+                # 3. Encode + API Recognition (all faces in flight at once)
+                future = recognize_pool.submit(recognize_crop, face)
+                pending.append((bbox, future))
+        finally:
+            wait([item for _, item in pending if isinstance(item, Future)])
+        fresh = []
+        for bbox, item in pending:
+            if isinstance(item, Future):
+                name, conf = item.result()
+                if name != "Unknown":
+                    fresh.append((bbox, name, conf, now))
+            else:
+                name, conf = item
+            results.append({
+                'bbox': bbox,
+                'name': name,
+                'confidence': conf
+            })
+        
+        # Only fresh recognitions extend the reuse window
+        recent_labels = fresh + [e for e in recent_labels if now - e[3] <= LABEL_REUSE_SECONDS]
+    return results
+
+def create_tracker():
+    """ KCF tracker from opencv-contrib (None if this OpenCV build has none) """
+    for module in (cv2, getattr(cv2, "legacy", None)):
+        factory = getattr(module, "TrackerKCF_create", None)
+        if factory is not None:
+            return factory()
+    return None
+
+def start_tracks(frame, results):
+    """ Start one tracker per recognized bbox; returns [] if tracking is unavailable """
+    tracks = []
+    for r in results:
+        tracker = create_tracker()
+        if tracker is None:
+            return []
+        x_min, y_min, x_max, y_max = r['bbox']
+        tracker.init(frame, (x_min, y_min, x_max - x_min, y_max - y_min))
+        tracks.append((tracker, r))
+    return tracks
+
+def update_tracks(tracks, frame):
+    """ Move cached bboxes with the trackers; None if any track is lost """
+    results = []
+    for tracker, r in tracks:
+        ok, (x, y, bw, bh) = tracker.update(frame)
+        if not ok:
+            return None
+        x, y, bw, bh = int(x), int(y), int(bw), int(bh)
+        results.append({
+            'bbox': (x, y, x + bw, y + bh),
+            'name': r['name'],
+            'confidence': r['confidence']
+        })
+    return results
+
 def processing_thread():
     """ Background thread for API calls """
-    global latest_frame, cached_results, is_running, new_frame_available
+    global cached_results, is_running
     
     # 🆕 Track last logged result to avoid duplicate entries
     last_logged_name = None
     last_log_time = 0
     LOG_COOLDOWN = 3.0  # 🆕 Log same person max once every 3 seconds
     
+    # Local trackers carry the last detection between API calls
+    tracks = []
+    frames_since_detect = 0
+    
     while is_running:
-        if latest_frame is not None and new_frame_available:
-            new_frame_available = False
-            frame_to_proc = latest_frame.copy()
+        # Blocks until capture publishes (timeout only to re-check is_running)
+        frame_to_proc = frames.take(timeout=0.5)
+        if frame_to_proc is not None:
             
             try:
-                # 1. Resize and Encode
-                h, w = frame_to_proc.shape[:2]
-                small_frame = cv2.resize(frame_to_proc, (RESIZE_WIDTH, int(h * RESIZE_WIDTH / w)))
-                _, encoded = cv2.imencode('.jpg', small_frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+                results = None
+                if tracks and frames_since_detect < DETECT_EVERY:
+                    results = update_tracks(tracks, frame_to_proc)
+                    frames_since_detect += 1
                 
-                # 2. API Detection
-                detect_response = session.post(
-                    opts.endpoint("vision/face"),
-                    files={"image": encoded.tobytes()},
-                    timeout=1
-                ).json()
-                
-                predictions = detect_response.get('predictions', [])
-                results = []
-                
-                if predictions:
-                    scale_x = w / RESIZE_WIDTH
-                    scale_y = h / (h * RESIZE_WIDTH / w)
-                    
-                    for pred in predictions:
-                        x_min, y_min = int(pred['x_min'] * scale_x), int(pred['y_min'] * scale_y)
-                        x_max, y_max = int(pred['x_max'] * scale_x), int(pred['y_max'] * scale_y)
-                        
-                        face = frame_to_proc[y_min:y_max, x_min:x_max]
-                        if face.size == 0: continue
-                        
-                        # 3. API Recognition
-                        _, f_enc = cv2.imencode('.jpg', face, [cv2.IMWRITE_JPEG_QUALITY, 70])
-                        rec_res = session.post(
-                            opts.endpoint("vision/face/recognize"),
-                            files={"image": f_enc.tobytes()},
-                            data={"min_confidence": MIN_CONFIDENCE},
-                            timeout=1
-                        ).json()
-                        
-                        name = "Unknown"
-                        conf = 0
-                        if rec_res.get("predictions"):
-                            user = rec_res["predictions"][0]
-                            name = user.get("userid", "Unknown")
-                            conf = user.get("confidence", 0)
-                        
-                        results.append({
-                            'bbox': (x_min, y_min, x_max, y_max),
-                            'name': name,
-                            'confidence': conf
-                        })
+                # Re-detect every DETECT_EVERY frames or when a track is lost
+                if results is None:
+                    results = detect_and_recognize(frame_to_proc)
+                    tracks = start_tracks(frame_to_proc, results)
+                    frames_since_detect = 1
                 
                 # Update shared results and LED
                 cached_results = results
                 any_recognized = any(r['name'] != "Unknown" for r in results) if results else False
                 control_led(any_recognized)
                 
-                # 🆕 Log to Excel (with cooldown to avoid spam)
+                # 🆕 Log event (with cooldown to avoid spam)
                 now = time.time()
                 for r in results:
                     name = r['name']
@@ -192,45 +532,97 @@ def processing_thread():
                     
                     # Only log if: different person OR cooldown passed
                     if name != last_logged_name or (now - last_log_time) >= LOG_COOLDOWN:
-                        threading.Thread(
-                            target=log_to_excel,
-                            args=(name, conf, any_recognized),
-                            daemon=True
-                        ).start()
+                        log_event(name, conf, any_recognized)
                         last_logged_name = name
                         last_log_time = now
                         print(f"📝 Logged: {name} ({conf:.3f})")
                 
             except Exception as e:
                 print(f"Proc Error: {e}")
-        else:
-            time.sleep(0.01)
+            frames.release(frame_to_proc)
 
-def main():
-    global latest_frame, is_running, new_frame_available
+def open_capture():
+    """ Open the RTSP stream, returns (cap, frames to flush per read) """
+    if GST_DECODER:
+        # appsink keeps only the newest frame, so no grab() flushing is needed
+        pipeline = (f"rtspsrc location={RTSP_URL} latency=0 ! rtph264depay ! h264parse ! "
+                    f"{GST_DECODER} ! videoconvert ! video/x-raw,format=BGR ! "
+                    "appsink drop=1 max-buffers=1 sync=false")
+        cap = cv2.VideoCapture(pipeline, cv2.CAP_GSTREAMER)
+        if cap.isOpened():
+            return cap, 0
+        print("GStreamer pipeline failed, falling back to FFmpeg")
     
-    # 🆕 Initialize Excel log
-    init_excel_log()
-    
-    cap = VideoStream(RTSP_URL).start()
-    time.sleep(2.0)
+    cap = cv2.VideoCapture(RTSP_URL, cv2.CAP_FFMPEG)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap, FLUSH_FRAMES
+
+def read_latest(cap, flush_frames):
+    """ Drop queued RTSP frames and decode only the newest one """
+    for _ in range(flush_frames):
+        cap.grab()
+    ok, frame = cap.read()
+    return frame if ok else None
+
+def main():
+    global is_running
     
-    t = threading.Thread(target=processing_thread, daemon=True)
-    t.start()
+    # 🆕 Initialize log
+    init_log()
     
-    print("System Live. Press 'q' to quit.")
-    print(f"📊 Logging to: {LOG_FILE}\n")
+    cap = t = None
+    try:
+        cap, flush_frames = open_capture()
+        if not cap.isOpened():
+            print("Cannot open stream")
+            return
+        
+        opts.warmUpDetector(session, encode_jpg(np.zeros((64, 64, 3), np.uint8)))
+        t = threading.Thread(target=processing_thread, daemon=True)
+        t.start()
+        
+        print("System Live. Press 'q' to quit.")
+        print(f"📊 Logging to: {CSV_LOG_FILE}\n")
+        run_display(cap, flush_frames)
+    finally:
+        # Also runs on Ctrl+C / errors: queued rows reach the CSV and the XLSX is rebuilt
+        is_running = False
+        if t is not None:
+            t.join()
+        recognize_pool.shutdown(wait=False)
+        control_led(False, force=True)
+        if cap is not None:
+            cap.release()
+        cv2.destroyAllWindows()
+        close_log()
+        export_excel_log()
+        print(f"\n✅ Done! Log saved to: {LOG_FILE}")
+
+def run_display(cap, flush_frames):
+    """Capture/display loop until 'q'"""
+    frame_width = None
+    scale_q16 = 1 << 16
 
     while True:
-        frame = cap.read()
-        if frame is None: continue
+        frame = read_latest(cap, flush_frames)
+        if frame is None:
+            # Stream dropped: back off, but keep the window responsive so 'q' still quits
+            time.sleep(0.01)
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+            continue
         
-        latest_frame = frame
-        new_frame_available = True
+        # Hand a downscaled private copy to the worker; `frame` is drawn on below
+        frames.publish(frame, RESIZE_WIDTH)
         
-        # Draw results (unchanged)
+        # Bboxes are in RESIZE_WIDTH coordinates; the aspect ratio is kept, so one
+        # 16.16 fixed-point ratio scales both axes (recomputed only on resolution change)
+        if frame.shape[1] != frame_width:
+            frame_width = frame.shape[1]
+            scale_q16 = (frame_width << 16) // RESIZE_WIDTH
+        # Draw results straight onto the frame
         for result in cached_results:
-            x_min, y_min, x_max, y_max = result['bbox']
+            x_min, y_min, x_max, y_max = ((v * scale_q16) >> 16 for v in result['bbox'])
             name, conf = result['name'], result['confidence']
             color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
             
@@ -243,12 +635,5 @@ def main():
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
 
-    is_running = False
-    t.join()
-    control_led(False)
-    cap.stop()
-    cv2.destroyAllWindows()
-    print(f"\n✅ Done! Log saved to: {LOG_FILE}")
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
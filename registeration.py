@@ -11,18 +11,51 @@ Keys:
 """
 
 import os
+import sys
 import cv2
 import time
 import queue
 import threading
 import datetime
+from collections import deque
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 from options import Options
 
+# Samples and detect frames are encoded with simplejpeg if present, else PyTurboJPEG,
+# else cv2.imencode (see encode_jpg)
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+turbo = None
+if simplejpeg is None:
+    # only loaded when it would actually be used; TurboJPEG() raises RuntimeError when
+    # libturbojpeg is missing or too old (e.g. the libjpeg-turbo 2.x on Pi OS / Ubuntu 22.04)
+    try:
+        from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+        turbo = TurboJPEG()
+    except (ImportError, OSError, RuntimeError):
+        turbo = None
+# post_json() parses replies with orjson when it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+# numba is optional; with it, many boxes are drawn in one compiled call
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
 # -------------------- SETTINGS --------------------
 USE_WEBCAM = True               # ✅ NOW: True (webcam). Later: False (RTSP)
 PI_IP = "172.23.28.195"         # later replace with your Pi's IP
 RTSP_URL = f"rtsp://{PI_IP}:8554/feeder"
+# Webcam: take the camera's own MJPEG frames (V4L2 only) and save/register them
+# as-is instead of decode -> re-encode
+CAMERA_MJPEG = sys.platform.startswith("linux")
 
 # Low-latency RTSP hints (used only when USE_WEBCAM=False)
 os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = (
@@ -31,8 +64,14 @@ os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = (
 
 # Speed tuning
 RESIZE_W, RESIZE_H = 640, 480
+DETECT_W, DETECT_H = 320, 240   # detector input (display/saved samples stay RESIZE_W x RESIZE_H)
+DETECT_SCALE = RESIZE_W // DETECT_W
 JPEG_QUALITY = 65
-DETECT_EVERY_N_FRAMES = 3
+NUMBA_BOX_MIN = 3  # draw boxes with the numba kernel from this many faces up
+HUD_H = 100  # rows covered by the cached status text strip
+# Resizes run on the GPU (OpenCL T-API) when available
+USE_OPENCL = cv2.ocl.haveOpenCL()
+cv2.ocl.setUseOpenCL(USE_OPENCL)
 
 # Registration tuning
 DEFAULT_SAMPLES = 10
@@ -46,22 +85,36 @@ if not getattr(opts, "imageDir", "") or opts.imageDir.strip() == "":
 os.makedirs(opts.imageDir, exist_ok=True)
 
 session = requests.Session()
+# Keep-Alive pool: detect worker + register threads reuse open connections
+adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+session.headers["Connection"] = "keep-alive"
 
 def post_json(url: str, *, files=None, data=None, timeout=2.0):
     try:
-        r = session.post(url, files=files, data=data, timeout=timeout)
-        return r.json()
+        r = session.post(url, files=files, data=data, timeout=timeout, stream=False)
+        return orjson.loads(r.content) if orjson is not None else r.json()
     except Exception as e:
         return {"error": str(e)}
 
 def encode_jpg(frame):
+    # one allocation per encode: simplejpeg/turbojpeg return bytes; the cv2 buffer is
+    # handed out as a memoryview (requests and file.write take it as-is, no copy).
+    # BGR->YCbCr, 4:2:0 chroma downsampling and DCT all happen in the one libjpeg-turbo call
+    if simplejpeg is not None:
+        return True, simplejpeg.encode_jpeg(np.ascontiguousarray(frame), quality=JPEG_QUALITY,
+                                            colorspace="BGR", colorsubsampling="420", fastdct=True)
+    if turbo is not None:
+        return True, turbo.encode(np.ascontiguousarray(frame), quality=JPEG_QUALITY,
+                                  pixel_format=TJPF_BGR, jpeg_subsample=TJSAMP_420)
     ok, jpg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
-    return ok, (jpg.tobytes() if ok else b"")
+    return ok, (jpg.data if ok else b"")
 
-def detect_faces_bytes(jpg_bytes: bytes) -> dict:
+def detect_faces_bytes(jpg_bytes) -> dict:
     return post_json(opts.endpoint("vision/face"), files={"image": jpg_bytes}, timeout=1.2)
 
-def register_face_bytes(jpg_bytes: bytes, user_id: str) -> dict:
+def register_face_bytes(jpg_bytes, user_id: str) -> dict:
     return post_json(
         opts.endpoint("vision/face/register"),
         files={"image": jpg_bytes},
@@ -69,31 +122,144 @@ def register_face_bytes(jpg_bytes: bytes, user_id: str) -> dict:
         timeout=2.5
     )
 
-def detector_worker(in_q: queue.Queue, out_q: queue.Queue, stop_evt: threading.Event):
+def detector_worker(in_slot: deque, out_slot: deque, frame_evt: threading.Event,
+                    ready: threading.Event, stop_evt: threading.Event):
+    # in_slot/out_slot are deque(maxlen=1): append replaces, so only the newest survives.
+    # ready is set whenever the worker is idle: the producer sends one frame per
+    # round trip, so detection paces itself to the server instead of a frame count
     while not stop_evt.is_set():
+        if not frame_evt.wait(timeout=0.1):
+            continue
+        frame_evt.clear()
         try:
-            jpg_bytes = in_q.get(timeout=0.1)
-        except queue.Empty:
+            jpg_bytes = in_slot.pop()
+        except IndexError:
             continue
 
         det = detect_faces_bytes(jpg_bytes)
         preds = det.get("predictions", []) if isinstance(det, dict) else []
         err = det.get("error") if isinstance(det, dict) else None
+        # only the 4 coords are kept, as tuples scaled from the DETECT_W frame to the
+        # RESIZE_W one; no per-face dict survives past this point
+        k = DETECT_SCALE
+        boxes = [(p["x_min"] * k, p["y_min"] * k, p["x_max"] * k, p["y_max"] * k) for p in preds]
+
+        out_slot.append({"boxes": boxes, "error": err})
+        ready.set()
 
-        # keep only newest output
+def saver_worker(saver_q: queue.Queue):
+    # writes (path, jpg bytes) off the UI thread; None = every queued save is done
+    while True:
+        item = saver_q.get()
+        if item is None:
+            return
+        path, jpg_bytes = item
         try:
-            while True:
-                out_q.get_nowait()
-        except queue.Empty:
-            pass
-        out_q.put({"predictions": preds, "error": err})
+            with open(path, "wb") as f:
+                f.write(jpg_bytes)
+            print(f"[SAVE] {path}")
+        except OSError as e:
+            print(f"[ERROR] Save failed {path}: {e}")
+
+def _draw_boxes_kernel(img, boxes, color, thickness):
+    # writes the 4 borders of each (x_min, y_min, x_max, y_max) box straight into img
+    h, w = img.shape[0], img.shape[1]
+    for i in range(boxes.shape[0]):
+        x0 = max(boxes[i, 0], 0)
+        y0 = max(boxes[i, 1], 0)
+        x1 = min(boxes[i, 2], w - 1)
+        y1 = min(boxes[i, 3], h - 1)
+        if x0 > x1 or y0 > y1:
+            continue
+        for y in range(y0, min(y0 + thickness, y1 + 1)):
+            for x in range(x0, x1 + 1):
+                img[y, x, :] = color
+        for y in range(max(y1 - thickness + 1, y0), y1 + 1):
+            for x in range(x0, x1 + 1):
+                img[y, x, :] = color
+        for y in range(y0, y1 + 1):
+            for x in range(x0, min(x0 + thickness, x1 + 1)):
+                img[y, x, :] = color
+            for x in range(max(x1 - thickness + 1, x0), x1 + 1):
+                img[y, x, :] = color
+
+if njit is not None:
+    _draw_boxes_kernel = njit(cache=True)(_draw_boxes_kernel)
+
+def draw_boxes(img, boxes, color, thickness=2):
+    # boxes: (x_min, y_min, x_max, y_max) tuples
+    if njit is not None and len(boxes) >= NUMBA_BOX_MIN:
+        _draw_boxes_kernel(img, np.array(boxes, np.int32), np.array(color, np.uint8), thickness)
+    else:
+        for x0, y0, x1, y1 in boxes:
+            cv2.rectangle(img, (x0, y0), (x1, y1), color, thickness)
+
+def render_hud(user_name, saved, target_samples, latest_err, num_faces):
+    # status lines rendered once per state change; returns (strip, mask of text pixels)
+    strip = np.zeros((HUD_H, RESIZE_W, 3), np.uint8)
+    cv2.putText(strip, f"Registering: {user_name} | Saved: {saved}/{target_samples} | q=Quit",
+                (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2, cv2.LINE_AA)
+    if latest_err:
+        cv2.putText(strip, f"Detect error: {latest_err}", (10, 90),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0, 0, 255), 2, cv2.LINE_AA)
+    elif num_faces != 1:
+        cv2.putText(strip, "Show ONLY ONE face clearly!", (10, 90),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2, cv2.LINE_AA)
+    else:
+        cv2.putText(strip, "OK: 1 face detected (auto capture soon)", (10, 90),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2, cv2.LINE_AA)
+    return strip, strip.any(axis=2).astype(np.uint8)
+
+def decode_jpg(jpg_bytes):
+    if simplejpeg is not None:
+        return simplejpeg.decode_jpeg(jpg_bytes, colorspace="BGR")
+    return cv2.imdecode(np.frombuffer(jpg_bytes, np.uint8), cv2.IMREAD_COLOR)
+
+def capture_worker(cap, slot: deque, stop_evt: threading.Event):
+    # grab as fast as the source delivers; slot (maxlen=1) keeps only the newest
+    # (frame, camera JPEG bytes or None)
+    while not stop_evt.is_set():
+        ret, frame = cap.read()
+        if not ret or frame is None:
+            time.sleep(0.01)
+            continue
+        cam_jpg = None
+        if frame.ndim == 2 and frame.shape[0] == 1:
+            # undecoded MJPEG (CONVERT_RGB=0): keep the bytes, decode only for display
+            cam_jpg = frame.tobytes()
+            try:
+                frame = decode_jpg(cam_jpg)
+            except Exception:
+                frame = None  # corrupt/non-JPEG buffer: skip it, keep the thread alive
+            if frame is None:
+                continue
+        slot.append((frame, cam_jpg))
 
 def open_capture():
     if USE_WEBCAM:
-        cap = cv2.VideoCapture(0)
+        mjpg = cv2.VideoWriter_fourcc(*"MJPG")
+        if CAMERA_MJPEG:
+            cap = cv2.VideoCapture(0, cv2.CAP_V4L2)
+            cap.set(cv2.CAP_PROP_FOURCC, mjpg)
+        else:
+            cap = cv2.VideoCapture(0)
+        # ask the driver for the working size so the per-frame resize is a no-op
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, RESIZE_W)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, RESIZE_H)
+        cap.set(cv2.CAP_PROP_FPS, 30)
+        if CAMERA_MJPEG:
+            # only take undecoded buffers once the driver really delivers MJPG
+            # (a YUYV-only camera would hand out raw YUYV bytes instead)
+            if int(cap.get(cv2.CAP_PROP_FOURCC)) == mjpg:
+                cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+            else:
+                cap.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+                print("[WARN] camera did not accept MJPG; using decoded BGR frames")
     else:
         cap = cv2.VideoCapture(RTSP_URL, cv2.CAP_FFMPEG)
-        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    # V4L2 queues 4 frames by default; keep only the newest on both paths
+    if not cap.set(cv2.CAP_PROP_BUFFERSIZE, 1):
+        print("[WARN] buffer size not reduced; latency higher")
     return cap
 
 def main():
@@ -119,77 +285,110 @@ def main():
         print("[ERROR] Cannot open video source.")
         return
 
-    stop_evt = threading.Event()
-    in_q = queue.Queue(maxsize=1)
-    out_q = queue.Queue(maxsize=1)
+    print("[INFO] Warming up detector...")
+    opts.warmUpDetector(session, encode_jpg(np.zeros((64, 64, 3), np.uint8))[1])
+    if njit is not None:
+        # compile the box kernel now, not on the first frame with NUMBA_BOX_MIN faces
+        _draw_boxes_kernel(np.zeros((4, 4, 3), np.uint8), np.zeros((1, 4), np.int32),
+                           np.zeros(3, np.uint8), 2)
 
-    t = threading.Thread(target=detector_worker, args=(in_q, out_q, stop_evt), daemon=True)
+    stop_evt = threading.Event()
+    in_slot = deque(maxlen=1)
+    out_slot = deque(maxlen=1)
+    frame_evt = threading.Event()
+    detector_ready = threading.Event()
+    detector_ready.set()
+
+    t = threading.Thread(target=detector_worker,
+                         args=(in_slot, out_slot, frame_evt, detector_ready, stop_evt), daemon=True)
     t.start()
 
-    frame_id = 0
-    latest_preds = []
+    frame_slot = deque(maxlen=1)
+    cap_t = threading.Thread(target=capture_worker, args=(cap, frame_slot, stop_evt), daemon=True)
+    cap_t.start()
+
+    saver_q = queue.Queue()
+    saver_t = threading.Thread(target=saver_worker, args=(saver_q,), daemon=True)
+    saver_t.start()
+
+    # resize target reused every frame: encoded first, then drawn on for display
+    resize_buf = np.empty((RESIZE_H, RESIZE_W, 3), np.uint8)
+    detect_buf = np.empty((DETECT_H, DETECT_W, 3), np.uint8)
+    latest_boxes = []
     latest_err = None
     saved = 0
     last_capture = 0.0
+    hud_state = None
+    ts_epoch, ts = 0, ""
 
     while True:
-        if not cap.grab():
-            continue
-        ret, frame = cap.retrieve()
-        if not ret or frame is None:
+        try:
+            captured, cam_jpg = frame_slot.pop()
+        except IndexError:
+            time.sleep(0.002)
             continue
 
-        frame = cv2.resize(frame, (RESIZE_W, RESIZE_H))
-        raw = frame.copy()
-        frame_id += 1
-
-        # send to detector
-        if DETECT_EVERY_N_FRAMES <= 1 or (frame_id % DETECT_EVERY_N_FRAMES == 0):
-            ok, jpg_bytes = encode_jpg(raw)
-            if ok:
-                try:
-                    in_q.put_nowait(jpg_bytes)
-                except queue.Full:
-                    try:
-                        in_q.get_nowait()
-                    except queue.Empty:
-                        pass
-                    try:
-                        in_q.put_nowait(jpg_bytes)
-                    except queue.Full:
-                        pass
+        # driver already delivers RESIZE_W x RESIZE_H -> use the popped frame as-is
+        gpu_frame = None
+        if captured.shape == resize_buf.shape:
+            frame = captured
+        else:
+            if USE_OPENCL:
+                # keep the resized UMat on the device for the detector downscale too
+                gpu_frame = cv2.resize(cv2.UMat(captured), (RESIZE_W, RESIZE_H))
+                frame = gpu_frame.get()
+            else:
+                frame = cv2.resize(captured, (RESIZE_W, RESIZE_H), dst=resize_buf)
+            cam_jpg = None  # camera JPEG no longer matches the box coordinates
 
         # read latest detection
         try:
-            out = out_q.get_nowait()
-            latest_preds = out.get("predictions", [])
+            out = out_slot.pop()
+            latest_boxes = out["boxes"]
             latest_err = out.get("error")
-        except queue.Empty:
+        except IndexError:
             pass
 
-        num_faces = len(latest_preds)
+        num_faces = len(latest_boxes)
+
+        now = time.time()
+        detect_due = detector_ready.is_set()
+        capture_due = num_faces == 1 and saved < target_samples and (now - last_capture) >= CAPTURE_COOLDOWN
+
+        # encode from the clean frame (before any overlay is drawn on it): a small
+        # copy for the detector, the full frame once for the saved sample + register call
+        jpg_bytes = b""
+        if capture_due:
+            if cam_jpg is not None:
+                jpg_bytes = cam_jpg
+            else:
+                ok, jpg_bytes = encode_jpg(frame)
 
-        # UI
-        ts = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # send to detector
+        if detect_due:
+            if gpu_frame is not None:
+                small = cv2.resize(gpu_frame, (DETECT_W, DETECT_H), interpolation=cv2.INTER_AREA).get()
+            else:
+                small = cv2.resize(frame, (DETECT_W, DETECT_H), dst=detect_buf, interpolation=cv2.INTER_AREA)
+            ok, det_bytes = encode_jpg(small)
+            if ok:
+                detector_ready.clear()
+                in_slot.append(det_bytes)
+                frame_evt.set()
+
+        # UI: only the timestamp is rasterized per frame, status lines come from the cache
+        epoch = int(now)
+        if epoch != ts_epoch:  # the string only changes once a second
+            ts_epoch, ts = epoch, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(epoch))
         cv2.putText(frame, ts, (10, 30),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2, cv2.LINE_AA)
-        cv2.putText(frame, f"Registering: {user_name} | Saved: {saved}/{target_samples} | q=Quit",
-                    (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2, cv2.LINE_AA)
+        if (saved, latest_err, num_faces == 1) != hud_state:
+            hud_state = (saved, latest_err, num_faces == 1)
+            hud, hud_mask = render_hud(user_name, saved, target_samples, latest_err, num_faces)
+        cv2.copyTo(hud, hud_mask, frame[:HUD_H])  # in place: the row slice is contiguous
 
         # boxes
-        for p in latest_preds:
-            cv2.rectangle(frame, (p["x_min"], p["y_min"]), (p["x_max"], p["y_max"]), (0, 0, 255), 2)
-
-        # message
-        if latest_err:
-            cv2.putText(frame, f"Detect error: {latest_err}", (10, 90),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0, 0, 255), 2, cv2.LINE_AA)
-        elif num_faces != 1:
-            cv2.putText(frame, "Show ONLY ONE face clearly!", (10, 90),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2, cv2.LINE_AA)
-        else:
-            cv2.putText(frame, "OK: 1 face detected (auto capture soon)", (10, 90),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2, cv2.LINE_AA)
+        draw_boxes(frame, latest_boxes, (0, 0, 255))
 
         cv2.imshow("Registration (Threaded)", frame)
 
@@ -197,22 +396,18 @@ def main():
         if key == ord("q"):
             break
 
-        # auto capture + async register
-        now = time.time()
-        if num_faces == 1 and saved < target_samples and (now - last_capture) >= CAPTURE_COOLDOWN:
+        # auto capture + async register (reuses this tick's JPEG, no re-encode)
+        if capture_due and jpg_bytes:
             last_capture = now
 
             filename = f"{user_name}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}_{saved+1}.jpg"
             path = os.path.join(opts.imageDir, filename)
-            cv2.imwrite(path, raw)
-            print(f"[SAVE] {path}")
+            saver_q.put((path, jpg_bytes))
 
-            ok2, jpg2 = encode_jpg(raw)
-            if ok2:
-                def do_register(name, bytes_):
-                    resp = register_face_bytes(bytes_, name)
-                    print(f"[REGISTER] {name} -> {resp}")
-                threading.Thread(target=do_register, args=(user_name, jpg2), daemon=True).start()
+            def do_register(name, bytes_):
+                resp = register_face_bytes(bytes_, name)
+                print(f"[REGISTER] {name} -> {resp}")
+            threading.Thread(target=do_register, args=(user_name, jpg_bytes), daemon=True).start()
 
             saved += 1
 
@@ -221,6 +416,9 @@ def main():
                 break
 
     stop_evt.set()
+    saver_q.put(None)
+    saver_t.join()
+    cap_t.join()
     cap.release()
     cv2.destroyAllWindows()
     session.close()
@@ -2,11 +2,22 @@
 import cv2
 import os
 import time
+import threading
+from collections import deque
 
 os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = "rtsp_transport;tcp|fflags;nobuffer|flags;low_delay"
 
 rtsp_url = "rtsp://172.23.28.195:8554/feeder"
 
+def capture_worker(cap, slot, stop_evt):
+    # Grab as fast as the stream delivers; slot (maxlen=1) keeps only the newest frame
+    while not stop_evt.is_set():
+        ret, frame = cap.read()
+        if not ret:
+            time.sleep(0.01)
+            continue
+        slot.append(frame)
+
 def main():
     cap = cv2.VideoCapture(rtsp_url, cv2.CAP_FFMPEG)
     cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
@@ -17,12 +28,19 @@ def main():
     
     print("Testing stream smoothness - Press 'q' to quit")
     
+    stop_evt = threading.Event()
+    frame_slot = deque(maxlen=1)
+    cap_t = threading.Thread(target=capture_worker, args=(cap, frame_slot, stop_evt), daemon=True)
+    cap_t.start()
+    
     frame_count = 0
     start = time.time()
     
     while True:
-        ret, frame = cap.read()
-        if not ret:
+        try:
+            frame = frame_slot.pop()
+        except IndexError:
+            time.sleep(0.002)
             continue
         
         frame_count += 1
@@ -39,6 +57,8 @@ def main():
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
     
+    stop_evt.set()
+    cap_t.join()
     cap.release()
     cv2.destroyAllWindows()
 